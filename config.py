@@ -3,77 +3,111 @@ Configuration module for the Telegram Email Tester Bot
 Contains configuration settings and constants
 """
 
+import functools
 import os
-from typing import Dict, Any
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, Any, Mapping
 
+# Returned for unknown providers so lookups never allocate
+_NO_PRESET: Mapping[str, Any] = MappingProxyType({})
+
+
+def _env_int(name: str, default: str) -> int:
+    """Read an integer setting from the environment"""
+    return int(os.getenv(name, default))
+
+
+def _default_smtp_presets() -> Dict[str, Dict[str, Any]]:
+    """SMTP provider presets, keyed by lowercase provider name"""
+    return {
+        'gmail': {
+            'host': 'smtp.gmail.com',
+            'port': 587,
+            'use_tls': True,
+            'use_ssl': False,
+            'note': 'Use app-specific password'
+        },
+        'outlook': {
+            'host': 'smtp-mail.outlook.com',
+            'port': 587,
+            'use_tls': True,
+            'use_ssl': False,
+            'note': 'Use app-specific password'
+        },
+        'yahoo': {
+            'host': 'smtp.mail.yahoo.com',
+            'port': 587,
+            'use_tls': True,
+            'use_ssl': False,
+            'note': 'Use app-specific password'
+        }
+    }
+
+
+@dataclass(frozen=True)
 class Config:
     """Configuration class for the bot"""
+
+    # Telegram Bot Configuration
+    bot_token: str = field(default_factory=lambda: os.getenv('TELEGRAM_BOT_TOKEN', ''), repr=False)
+
+    # Rate limiting settings
+    max_emails_per_test: int = field(default_factory=lambda: _env_int('MAX_EMAILS_PER_TEST', '100'))
+    max_tests_per_user_per_hour: int = field(default_factory=lambda: _env_int('MAX_TESTS_PER_HOUR', '10'))
+
+    # Email settings
+    email_timeout: int = field(default_factory=lambda: _env_int('EMAIL_TIMEOUT', '30'))  # seconds
+    max_message_size: int = field(default_factory=lambda: _env_int('MAX_MESSAGE_SIZE', '10485760'))  # 10MB
+    thread_pool_size: int = field(default_factory=lambda: _env_int('THREAD_POOL_SIZE', '32'))  # SMTP worker threads
+
+    # Security settings
+    session_timeout: int = field(default_factory=lambda: _env_int('SESSION_TIMEOUT', '1800'))  # 30 minutes
+
+    # SMTP provider presets
+    smtp_presets: Mapping[str, Mapping[str, Any]] = field(default_factory=_default_smtp_presets)
+
+    # Validation result, computed once since the config never changes
+    _validation: Mapping[str, Any] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # The config is shared process-wide, so freeze the presets as well
+        object.__setattr__(self, 'smtp_presets', MappingProxyType({
+            name.lower(): MappingProxyType(dict(preset))
+            for name, preset in self.smtp_presets.items()
+        }))
+        errors = tuple(message for failed, message in (
+            (not self.bot_token, "TELEGRAM_BOT_TOKEN environment variable not set"),
+            (self.max_emails_per_test <= 0, "MAX_EMAILS_PER_TEST must be greater than 0"),
+            (self.email_timeout <= 0, "EMAIL_TIMEOUT must be greater than 0"),
+            (self.thread_pool_size <= 0, "THREAD_POOL_SIZE must be greater than 0"),
+        ) if failed)
+        # Read-only, since every caller shares the cached config
+        object.__setattr__(self, '_validation', MappingProxyType({
+            'valid': not errors,
+            'errors': errors
+        }))
     
-    def __init__(self):
-        # Telegram Bot Configuration
-        self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN', '')
-        
-        # Rate limiting settings
-        self.max_emails_per_test = int(os.getenv('MAX_EMAILS_PER_TEST', '100'))
-        self.max_tests_per_user_per_hour = int(os.getenv('MAX_TESTS_PER_HOUR', '10'))
-        
-        # Email settings
-        self.email_timeout = int(os.getenv('EMAIL_TIMEOUT', '30'))  # seconds
-        self.max_message_size = int(os.getenv('MAX_MESSAGE_SIZE', '10485760'))  # 10MB
-        
-        # Security settings
-        self.session_timeout = int(os.getenv('SESSION_TIMEOUT', '1800'))  # 30 minutes
-        
-        # SMTP provider presets
-        self.smtp_presets = {
-            'gmail': {
-                'host': 'smtp.gmail.com',
-                'port': 587,
-                'use_tls': True,
-                'use_ssl': False,
-                'note': 'Use app-specific password'
-            },
-            'outlook': {
-                'host': 'smtp-mail.outlook.com',
-                'port': 587,
-                'use_tls': True,
-                'use_ssl': False,
-                'note': 'Use app-specific password'
-            },
-            'yahoo': {
-                'host': 'smtp.mail.yahoo.com',
-                'port': 587,
-                'use_tls': True,
-                'use_ssl': False,
-                'note': 'Use app-specific password'
-            }
-        }
-    
-    def get_smtp_preset(self, provider: str) -> Dict[str, Any]:
+    def get_smtp_preset(self, provider: str) -> Mapping[str, Any]:
         """Get SMTP preset configuration for a provider"""
-        return self.smtp_presets.get(provider.lower(), {})
+        # Presets are keyed in lowercase; skip the copy when already lowercase
+        if not provider.islower():
+            provider = provider.lower()
+        return self.smtp_presets.get(provider, _NO_PRESET)
     
-    def get_all_presets(self) -> Dict[str, Dict[str, Any]]:
+    def get_all_presets(self) -> Mapping[str, Mapping[str, Any]]:
         """Get all SMTP presets"""
         return self.smtp_presets
     
-    def validate_config(self) -> Dict[str, Any]:
+    def validate_config(self) -> Mapping[str, Any]:
         """Validate configuration"""
-        errors = []
-        
-        if not self.bot_token:
-            errors.append("TELEGRAM_BOT_TOKEN environment variable not set")
-        
-        if self.max_emails_per_test <= 0:
-            errors.append("MAX_EMAILS_PER_TEST must be greater than 0")
-        
-        if self.email_timeout <= 0:
-            errors.append("EMAIL_TIMEOUT must be greater than 0")
-        
-        return {
-            'valid': len(errors) == 0,
-            'errors': errors
-        }
+        return self._validation
+
+
+@functools.lru_cache(maxsize=1)
+def get_config() -> Config:
+    """Get the process-wide configuration, read from the environment once"""
+    return Config()
 
 # Global constants
 DEFAULT_TEST_EMAIL_SUBJECT = "Email Delivery Test - Telegram Bot"
@@ -4,35 +4,65 @@ Domain management module for the Telegram Email Tester Bot
 Handles domain storage and admin operations
 """
 
+import functools
 import json
 import os
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from typing import FrozenSet, List, Dict, Any, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional speedup, stdlib json is the fallback
+    orjson = None
+
+if orjson is not None:
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+else:
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, indent=2).encode('utf-8')
+
+# Default admin ID if no environment variable is set
+DEFAULT_ADMIN_IDS = frozenset({1645281955})
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_admin_ids(admin_ids_str: str) -> FrozenSet[int]:
+    """Parse a comma-separated list of admin user IDs"""
+    if not admin_ids_str:
+        return DEFAULT_ADMIN_IDS
+
+    try:
+        return frozenset(int(id.strip()) for id in admin_ids_str.split(',') if id.strip())
+    except ValueError:
+        return DEFAULT_ADMIN_IDS
+
 
 class DomainManager:
     def __init__(self, domains_file: str = "domains.json"):
         self.domains_file = domains_file
         self.admin_ids = self._load_admin_ids()
         self.domains = self._load_domains()
+        self._by_url = {domain['url']: domain for domain in self.domains}
+        self._snapshot: Optional[Tuple[Dict[str, str], ...]] = None
+        self._buffer_depth = 0
+        self._dirty = False
     
-    def _load_admin_ids(self) -> List[int]:
+    def _load_admin_ids(self) -> FrozenSet[int]:
         """Load admin user IDs from environment variable"""
-        admin_ids_str = os.getenv('TELEGRAM_ADMIN_IDS', '')
-        if not admin_ids_str:
-            # Default admin ID if no environment variable is set
-            return [1645281955]
-        
-        try:
-            return [int(id.strip()) for id in admin_ids_str.split(',') if id.strip()]
-        except ValueError:
-            return [1645281955]
+        return _parse_admin_ids(os.getenv('TELEGRAM_ADMIN_IDS', ''))
     
     def _load_domains(self) -> List[Dict[str, str]]:
         """Load domains from JSON file"""
         try:
             if os.path.exists(self.domains_file):
-                with open(self.domains_file, 'r') as f:
-                    data = json.load(f)
-                    return data.get('domains', [])
+                with open(self.domains_file, 'rb') as f:
+                    data = _loads(f.read())
+                return data.get('domains', [])
             return []
         except Exception:
             return []
@@ -40,58 +70,85 @@ class DomainManager:
     def _save_domains(self) -> bool:
         """Save domains to JSON file"""
         try:
-            data = {'domains': self.domains}
-            with open(self.domains_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            payload = _dumps({'domains': self.domains})
+            # Write to a temporary file and swap it in so a failed write
+            # never leaves a truncated domains file behind
+            tmp_file = self.domains_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_file, self.domains_file)
             return True
         except Exception:
             return False
     
+    def _commit(self) -> bool:
+        """Save changes now, or mark them pending inside a buffered block"""
+        self._snapshot = None
+        if self._buffer_depth:
+            self._dirty = True
+            return True
+        return self._save_domains()
+    
+    def flush(self) -> bool:
+        """Write pending changes from a buffered block to disk"""
+        if not self._dirty:
+            return True
+        self._dirty = False
+        return self._save_domains()
+    
+    @contextmanager
+    def buffered(self):
+        """Defer saving until the block exits, then write the file once"""
+        self._buffer_depth += 1
+        try:
+            yield self
+        finally:
+            self._buffer_depth -= 1
+            if not self._buffer_depth:
+                self.flush()
+    
+    @staticmethod
+    def _normalize_url(domain_url: str) -> str:
+        """Strip protocol and trailing slash from a domain URL"""
+        return domain_url.removeprefix('https://').removeprefix('http://').rstrip('/')
+    
     def is_admin(self, user_id: int) -> bool:
         """Check if user is admin"""
         return user_id in self.admin_ids
     
     def add_domain(self, domain_url: str, domain_name: str) -> bool:
         """Add a new domain"""
-        # Remove protocol if present
-        if domain_url.startswith('http://'):
-            domain_url = domain_url[7:]
-        elif domain_url.startswith('https://'):
-            domain_url = domain_url[8:]
-        
-        # Remove trailing slash
-        domain_url = domain_url.rstrip('/')
+        domain_url = self._normalize_url(domain_url)
         
         # Check if domain already exists
-        for domain in self.domains:
-            if domain['url'] == domain_url:
-                return False
+        if domain_url in self._by_url:
+            return False
         
-        self.domains.append({
+        domain = {
             'url': domain_url,
             'name': domain_name
-        })
-        return self._save_domains()
+        }
+        self.domains.append(domain)
+        self._by_url[domain_url] = domain
+        return self._commit()
     
     def remove_domain(self, domain_url: str) -> bool:
         """Remove a domain"""
-        initial_count = len(self.domains)
-        self.domains = [d for d in self.domains if d['url'] != domain_url]
+        if self._by_url.pop(domain_url, None) is None:
+            return False
         
-        if len(self.domains) < initial_count:
-            return self._save_domains()
-        return False
+        self.domains = list(self._by_url.values())
+        return self._commit()
     
-    def get_domains(self) -> List[Dict[str, str]]:
-        """Get all domains"""
-        return self.domains.copy()
+    def get_domains(self) -> Tuple[Dict[str, str], ...]:
+        """Get all domains as a read-only snapshot"""
+        if self._snapshot is None:
+            self._snapshot = tuple(self.domains)
+        return self._snapshot
     
     def get_domain_by_url(self, domain_url: str) -> Dict[str, str]:
         """Get domain by URL"""
-        for domain in self.domains:
-            if domain['url'] == domain_url:
-                return domain
-        return {}
+        return self._by_url.get(domain_url, {})
     
     def add_bulk_domains(self, domain_list: str) -> dict:
         """Add multiple domains from a text list"""
@@ -101,55 +158,31 @@ class DomainManager:
         skipped = []
         errors = []
         
-        for line in lines:
-            # Skip empty lines or comments
-            if not line or line.startswith('#'):
-                continue
+        # Save all changes at once
+        with self.buffered():
+            for line in lines:
+                # Skip empty lines or comments
+                if not line or line.startswith('#'):
+                    continue
                 
-            # Clean up domain
-            domain_url = line
-            if domain_url.startswith('http://'):
-                domain_url = domain_url[7:]
-            elif domain_url.startswith('https://'):
-                domain_url = domain_url[8:]
-            
-            domain_url = domain_url.rstrip('/')
-            
-            # Use domain as both URL and name for bulk add
-            domain_name = domain_url.title()
-            
-            # Check if domain already exists
-            exists = False
-            for domain in self.domains:
-                if domain['url'] == domain_url:
+                domain_url = self._normalize_url(line)
+                
+                # Use domain as both URL and name for bulk add
+                if self.add_domain(domain_url, domain_url.title()):
+                    added.append(domain_url)
+                else:
                     skipped.append(domain_url)
-                    exists = True
-                    break
             
-            if not exists:
-                self.domains.append({
-                    'url': domain_url,
-                    'name': domain_name
-                })
-                added.append(domain_url)
+            saved = self.flush()
         
-        # Save all changes at once
-        if added:
-            if self._save_domains():
-                return {
-                    'success': True,
-                    'added': added,
-                    'skipped': skipped,
-                    'errors': errors
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': 'Failed to save domains',
-                    'added': [],
-                    'skipped': skipped,
-                    'errors': errors
-                }
+        if not saved:
+            return {
+                'success': False,
+                'error': 'Failed to save domains',
+                'added': [],
+                'skipped': skipped,
+                'errors': errors
+            }
         
         return {
             'success': True,
@@ -161,4 +194,5 @@ class DomainManager:
     def clear_all_domains(self) -> bool:
         """Clear all domains (admin only)"""
         self.domains = []
-        return self._save_domains()
+        self._by_url = {}
+        return self._commit()
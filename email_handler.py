@@ -6,15 +6,179 @@ Handles SMTP connections and email sending
 import smtplib
 import asyncio
 import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import queue
+import random
+import re
+import socket
+import ssl
+import threading
+import time
+from email import policy
+from email.message import EmailMessage
 from email.utils import formataddr
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 import concurrent.futures
-import datetime
+import functools
+import hashlib
+import hmac
+import secrets
+from config import DEFAULT_SENDER_NAME, DEFAULT_TEST_EMAIL_SUBJECT, TEST_LINK_HTML, get_config
 
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=1)
+def _executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Shared thread pool for blocking SMTP work, reused across handlers"""
+    # Built on first use rather than at import, so it is sized from the
+    # config only after the bot has validated THREAD_POOL_SIZE
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=get_config().thread_pool_size,
+        thread_name_prefix='smtp'
+    )
+
+# One TLS context for every SMTP connection instead of one per connect. Like
+# smtplib's implicit default it does not verify certificates, so self-signed
+# test servers keep working
+_SSL_CONTEXT = ssl.create_default_context()
+_SSL_CONTEXT.check_hostname = False
+_SSL_CONTEXT.verify_mode = ssl.CERT_NONE
+_SSL_CONTEXT.options |= ssl.OP_NO_COMPRESSION
+
+# Idle authenticated SMTP connections, keyed on connection settings and the
+# owning campaign, so a new handler for the same campaign can skip the
+# TCP + TLS + AUTH handshake. A pool exists from its first checkout until it
+# is closed; connections returned after that are quit instead of pooled
+_SMTP_POOL: Dict[tuple, queue.Queue] = {}
+_SMTP_POOL_LOCK = threading.Lock()
+_SMTP_POOL_MAX_IDLE = 2
+
+# Pool keys carry a keyed digest of the password rather than the password
+_POOL_KEY_SECRET = secrets.token_bytes(32)
+
+# Reply codes a server uses to ask the client to slow down or come back later
+_THROTTLE_CODES = frozenset({421, 450, 451, 452})
+
+# Current throttle back-off per pool, keyed like _SMTP_POOL. The bot sends
+# one message per handler, so the delay has to outlive the handler to grow
+_THROTTLE_DELAYS: Dict[tuple, float] = {}
+_THROTTLE_BASE_DELAY = 0.5
+_THROTTLE_MAX_DELAY = 30.0
+
+# Reconnect back-off: doubles per attempt up to the cap, with jitter
+_CONNECT_RETRY_BASE_DELAY = 1.0
+_CONNECT_RETRY_MAX_DELAY = 30.0
+
+# Placeholders in the serialized message template, swapped per recipient
+_RECIPIENT_PLACEHOLDER = '__RCPT__@placeholder.invalid'
+_BUTTON_PLACEHOLDER = '__BUTTON__'
+
+# Lines of the message body that start with a dot, escaped as in smtplib's data()
+_LEADING_DOT = re.compile(rb'(?m)^\.')
+
+def _drain(idle: queue.Queue) -> None:
+    """Quit every connection waiting in an idle queue"""
+    while True:
+        try:
+            server = idle.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+def close_idle_connections() -> None:
+    """Close all pooled SMTP connections, e.g. on shutdown"""
+    with _SMTP_POOL_LOCK:
+        pools = list(_SMTP_POOL.values())
+        _SMTP_POOL.clear()
+        _THROTTLE_DELAYS.clear()
+    for idle in pools:
+        _drain(idle)
+
+def _end_transaction(server: smtplib.SMTP, *codes: int) -> None:
+    """Reset a failed transaction like sendmail() does, closing on 421"""
+    if 421 in codes:
+        server.close()
+        return
+    try:
+        server.rset()
+    except smtplib.SMTPServerDisconnected:
+        # Same as smtplib's _rset(): the caller raises the real refusal
+        pass
+
+def _sendmail(server: smtplib.SMTP, from_addr: str, to_addr: str, payload: bytes) -> None:
+    """Send one message like sendmail(), pipelining the envelope when supported"""
+    if not server.has_extn('pipelining'):
+        server.sendmail(from_addr, [to_addr], payload)
+        return
+
+    # RFC 2920: write MAIL, RCPT and DATA at once and read the three replies
+    # afterwards, saving two round-trips per message
+    server.send(f"MAIL FROM:{smtplib.quoteaddr(from_addr)}\r\n"
+                f"RCPT TO:{smtplib.quoteaddr(to_addr)}\r\n"
+                "DATA\r\n")
+    mail_code, mail_resp = server.getreply()
+    rcpt_code, rcpt_resp = server.getreply()
+    data_code, data_resp = server.getreply()
+
+    if mail_code != 250 or rcpt_code not in (250, 251) or data_code != 354:
+        if data_code == 354:
+            # The server opened DATA without a valid envelope; end it empty
+            try:
+                server.send(b".\r\n")
+                server.getreply()
+            except smtplib.SMTPServerDisconnected:
+                pass
+        _end_transaction(server, mail_code, rcpt_code, data_code)
+        if mail_code != 250:
+            raise smtplib.SMTPSenderRefused(mail_code, mail_resp, from_addr)
+        if rcpt_code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({to_addr: (rcpt_code, rcpt_resp)})
+        raise smtplib.SMTPDataError(data_code, data_resp)
+
+    body = _LEADING_DOT.sub(b'..', payload)
+    if not body.endswith(b'\r\n'):
+        body += b'\r\n'
+    server.send(body + b'.\r\n')
+    code, resp = server.getreply()
+    if code != 250:
+        _end_transaction(server, code)
+        raise smtplib.SMTPDataError(code, resp)
+
+@functools.lru_cache(maxsize=128)
+def _render_templates(custom_domain: str) -> Tuple[str, str]:
+    """Render the HTML and text bodies for a domain, leaving per-recipient fields open"""
+    # Only the button text and timestamp change between recipients, and the
+    # bot builds a new handler per message, so cache across handlers
+    if not custom_domain.isascii():
+        try:
+            # Punycode keeps the link host valid and both bodies ASCII
+            custom_domain = custom_domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            pass  # Not a valid IDN; the message falls back to 8bit UTF-8
+    link_html = TEST_LINK_HTML.format(domain=custom_domain, button_text='{button_text}')
+    html_template = f"""
+{link_html}
+        <p style="font-size: 14px; color: #6c757d;">
+            &bull; URL: https://{custom_domain}<br>
+        </p> <p>Timestamp: {{timestamp}}</p>
+        """
+    text_template = f"""
+{DEFAULT_TEST_EMAIL_SUBJECT}
+
+This is a test email sent via Telegram Email Tester Bot.
+
+Test Link: https://{custom_domain}
+Button Text: {{button_text}}
+
+If you received this email, your SMTP configuration is working correctly!
+
+---
+This email was sent by Telegram Email Tester Bot
+        """
+    return html_template, text_template
+
 class EmailHandler:
     def __init__(self, smtp_config: Dict[str, Any], custom_domain: str = None):
         """Initialize email handler with SMTP configuration"""
@@ -24,20 +188,114 @@ class EmailHandler:
         self.username = smtp_config['username']
         self.password = smtp_config['password']
         self.from_email = smtp_config.get('from_email', smtp_config['username'])  # Use from_email if provided, otherwise username
+        self._from_header = formataddr((DEFAULT_SENDER_NAME, self.from_email))
         self.use_tls = smtp_config.get('use_tls', True)
         self.use_ssl = smtp_config.get('use_ssl', False)
+        # Resolve the transport once: implicit SSL (port 465 typically uses SSL)
+        # or plain SMTP upgraded with STARTTLS when TLS is requested
+        self._implicit_ssl = self.use_ssl or self.port == 465
+        self._needs_starttls = self.use_tls and not self._implicit_ssl
         self.custom_domain = custom_domain or "example.com"
+        # Handlers sharing a pool_id (one per campaign) share pooled connections
+        self.pool_id = smtp_config.get('pool_id')
+        password_digest = hmac.digest(_POOL_KEY_SECRET, self.password.encode('utf-8'), hashlib.sha256)
+        self._pool_key = (self.host, self.port, self.username, password_digest,
+                          self.use_ssl, self.use_tls, self.pool_id)
+
+        self._html_template, self._text_template = _render_templates(self.custom_domain)
+
+    def _connect(self, timeout: int) -> smtplib.SMTP:
+        """Open an authenticated SMTP connection"""
+        if self._implicit_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=timeout, context=_SSL_CONTEXT)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=timeout)
+
+        try:
+            # SMTP is short command/reply exchanges; don't let Nagle delay them
+            server.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self._needs_starttls:
+                server.starttls(context=_SSL_CONTEXT)
+            server.login(self.username, self.password)
+        except BaseException:
+            server.close()
+            raise
+        return server
+
+    def _open_pool(self) -> queue.Queue:
+        """Get this handler's pool, creating it if it is not open yet"""
+        with _SMTP_POOL_LOCK:
+            return _SMTP_POOL.setdefault(self._pool_key, queue.Queue(maxsize=_SMTP_POOL_MAX_IDLE))
+
+    def _acquire(self) -> Optional[smtplib.SMTP]:
+        """Take a live pooled connection for this configuration, if any"""
+        idle = self._open_pool()
+
+        while True:
+            try:
+                server = idle.get_nowait()
+            except queue.Empty:
+                return None
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except Exception:
+                pass
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _release(self, server: smtplib.SMTP) -> None:
+        """Return a connection to the pool, closing it if the pool is full or was closed"""
+        with _SMTP_POOL_LOCK:
+            idle = _SMTP_POOL.get(self._pool_key)
+        # No pool means it was closed while this connection was checked out
+        if idle is not None:
+            try:
+                idle.put_nowait(server)
+                return
+            except queue.Full:
+                pass
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def _next_throttle_delay(self) -> float:
+        """Return how long to wait after a throttle reply, doubling the next wait"""
+        with _SMTP_POOL_LOCK:
+            delay = _THROTTLE_DELAYS.get(self._pool_key, _THROTTLE_BASE_DELAY)
+            _THROTTLE_DELAYS[self._pool_key] = min(_THROTTLE_MAX_DELAY, delay * 2)
+        return delay
+
+    def _reset_throttle(self) -> None:
+        """Forget the account's back-off once the server accepts mail again"""
+        if _THROTTLE_DELAYS:
+            with _SMTP_POOL_LOCK:
+                _THROTTLE_DELAYS.pop(self._pool_key, None)
+
+    def close(self) -> None:
+        """Close this handler's pool and the idle connections in it"""
+        with _SMTP_POOL_LOCK:
+            idle = _SMTP_POOL.pop(self._pool_key, None)
+            _THROTTLE_DELAYS.pop(self._pool_key, None)
+        if idle is not None:
+            _drain(idle)
+
+    async def aclose(self) -> None:
+        """Close this handler's pool off the event loop"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_executor(), self.close)
 
     async def test_connection(self) -> Dict[str, Any]:
         """Test SMTP connection"""
         try:
             # Run connection test in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                result = await loop.run_in_executor(executor, self._test_connection_sync)
-            return result
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_executor(), self._test_connection_sync)
         except Exception as e:
-            logger.error(f"Connection test error: {e}")
+            logger.error("Connection test error: %s", e)
             return {
                 'success': False,
                 'error': f"Connection test failed: {str(e)}"
@@ -46,21 +304,9 @@ class EmailHandler:
     def _test_connection_sync(self) -> Dict[str, Any]:
         """Universal SMTP connection test with optimized timeout"""
         server = None
+        self._open_pool()
         try:
-            # Universal SMTP handling based on port and SSL/TLS settings
-            if self.use_ssl or self.port == 465:
-                # SSL connection (port 465 typically uses SSL)
-                server = smtplib.SMTP_SSL(self.host, self.port, timeout=15)
-            else:
-                # Standard SMTP connection
-                server = smtplib.SMTP(self.host, self.port, timeout=15)
-                # Apply TLS if requested
-                if self.use_tls:
-                    server.starttls()
-
-            # Set timeout for login
-            server.sock.settimeout(12)
-            server.login(self.username, self.password)
+            server = self._connect(timeout=15)
             
             return {
                 'success': True,
@@ -89,21 +335,17 @@ class EmailHandler:
             }
         finally:
             if server:
-                try:
-                    server.quit()
-                except:
-                    pass
+                # Hand the authenticated session to the first send
+                self._release(server)
 
     async def send_test_emails(self, email_list: List[str]) -> Dict[str, Any]:
         """Send test emails to the provided list"""
         try:
             # Run email sending in thread pool
-            loop = asyncio.get_event_loop()
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                result = await loop.run_in_executor(executor, self._send_emails_sync, email_list)
-            return result
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_executor(), self._send_emails_sync, email_list)
         except Exception as e:
-            logger.error(f"Email sending error: {e}")
+            logger.error("Email sending error: %s", e)
             return {
                 'successful': [],
                 'failed': {email: str(e) for email in email_list}
@@ -114,38 +356,39 @@ class EmailHandler:
         successful = []
         failed = {}
         server = None
-        max_retries = 2
+        reusable = True
+        max_retries = 4
 
         def establish_connection():
             """Establish SMTP connection with retry logic"""
             for attempt in range(max_retries):
                 try:
-                    if self.use_ssl or self.port == 465:
-                        server = smtplib.SMTP_SSL(self.host, self.port, timeout=25)
-                    else:
-                        server = smtplib.SMTP(self.host, self.port, timeout=25)
-                        if self.use_tls:
-                            server.starttls()
-                    
-                    server.sock.settimeout(20)
-                    server.login(self.username, self.password)
-                    return server
+                    return self._connect(timeout=25)
+                except smtplib.SMTPAuthenticationError:
+                    # Wrong credentials will not start working on a retry
+                    raise
                 except Exception as e:
                     if attempt < max_retries - 1:
-                        logger.warning(f"Connection attempt {attempt + 1} failed, retrying: {e}")
-                        import time
-                        time.sleep(2)
+                        # Exponential back-off with jitter so reconnects don't arrive in lockstep
+                        delay = min(_CONNECT_RETRY_MAX_DELAY, _CONNECT_RETRY_BASE_DELAY * 2 ** attempt)
+                        delay *= random.uniform(0.5, 1.5)
+                        logger.warning("Connection attempt %d failed, retrying in %.1fs: %s", attempt + 1, delay, e)
+                        time.sleep(delay)
                     else:
                         raise e
             return None
 
         try:
-            server = establish_connection()
+            # Serialize the message once per batch; recipients only swap placeholders
+            batch_timestamp = time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime())
+            template = self._create_message_template(batch_timestamp)
+
+            server = self._acquire() or establish_connection()
             if not server:
                 raise Exception("Failed to establish SMTP connection")
 
             # Enhanced batch processing with connection health checks
-            batch_size = 3  # Smaller batches for better reliability
+            pause_every = 3  # Brief pause after every 3 emails
             connection_age = 0
             max_connection_age = 10  # Refresh connection after 10 emails
             
@@ -158,28 +401,40 @@ class EmailHandler:
                         server = establish_connection()
                         connection_age = 0
                     
-                    message = self._create_test_message(email)
+                    payload = self._render_message(template, email)
                     
                     # Send with retry on temporary failures
-                    sent = False
                     for attempt in range(2):
                         try:
-                            server.send_message(message)
+                            _sendmail(server, self.from_email, email, payload)
                             successful.append(email)
                             connection_age += 1
-                            sent = True
-                            logger.info(f"✅ Email sent to {email}")
+                            self._reset_throttle()
+                            logger.debug("✅ Email sent to %s", email)
                             break
                         except smtplib.SMTPRecipientsRefused as e:
                             failed[email] = f"Recipient refused: {str(e)}"
                             break
                         except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException) as e:
+                            smtp_code = getattr(e, 'smtp_code', 0)
+                            if smtp_code >= 500:
+                                # Permanent rejection (e.g. sender refused), a reconnect won't help
+                                failed[email] = f"Send rejected: {str(e)}"
+                                break
                             if attempt == 0:
-                                logger.warning(f"Connection issue, retrying for {email}: {e}")
+                                logger.warning("Connection issue, retrying for %s: %s", email, e)
+                                if smtp_code in _THROTTLE_CODES:
+                                    # Honour the server's rate limiting before retrying
+                                    time.sleep(self._next_throttle_delay())
+                                    if smtp_code != 421:
+                                        # A 45x reply leaves the session usable, retry on it
+                                        continue
+                                # Drop the broken session before opening a new one
+                                server.close()
                                 try:
                                     server = establish_connection()
                                     connection_age = 0
-                                except:
+                                except Exception:
                                     failed[email] = f"Connection retry failed: {str(e)}"
                                     break
                             else:
@@ -190,78 +445,70 @@ class EmailHandler:
                             break
                     
                     # Brief pause between emails for server courtesy
-                    if i < len(email_list) - 1 and i % 3 == 2:
-                        import time
+                    if i < len(email_list) - 1 and i % pause_every == pause_every - 1:
                         time.sleep(0.2)
 
                 except Exception as e:
                     failed[email] = f"Processing error: {str(e)}"
-                    logger.error(f"❌ Failed to process {email}: {e}")
+                    logger.error("❌ Failed to process %s: %s", email, e)
 
         except Exception as e:
-            logger.error(f"Major SMTP error: {e}")
+            logger.error("Major SMTP error: %s", e)
+            reusable = False
             # Mark all unsent emails as failed
+            done = set(successful)
+            done.update(failed)
             for email in email_list:
-                if email not in successful and email not in failed:
+                if email not in done:
                     failed[email] = f"SMTP connection error: {str(e)}"
         
         finally:
             if server:
-                try:
-                    server.quit()
-                except:
-                    pass
+                if reusable:
+                    # Keep the authenticated session for the next handler
+                    self._release(server)
+                else:
+                    try:
+                        server.quit()
+                    except (smtplib.SMTPException, OSError):
+                        pass
 
         # Log final results
         total_sent = len(successful)
         total_failed = len(failed)
         success_rate = (total_sent / len(email_list) * 100) if email_list else 0
-        logger.info(f"Batch complete: {total_sent} sent, {total_failed} failed ({success_rate:.1f}% success)")
+        logger.info("Batch complete: %d sent, %d failed (%.1f%% success)", total_sent, total_failed, success_rate)
 
         return {
             'successful': successful,
             'failed': failed
         }
 
-    def _create_test_message(self, recipient_email: str) -> MIMEMultipart:
-        """Create the test email message with HTML content"""
-        # Create message
-        message = MIMEMultipart('alternative')
-        message['From'] = formataddr(('Email Tester Bot', self.from_email))
-        message['To'] = recipient_email
-        message['Subject'] = 'Email Delivery Test - Telegram Bot'
+    def _create_message_template(self, batch_timestamp: str) -> bytes:
+        """Serialize the test email once, leaving recipient and button text as placeholders"""
+        # Create message; the SMTP policy serializes with CRLF line endings
+        message = EmailMessage(policy=policy.SMTP)
+        message['From'] = self._from_header
+        message['To'] = _RECIPIENT_PLACEHOLDER
+        message['Subject'] = DEFAULT_TEST_EMAIL_SUBJECT
 
         # HTML content with the specified link
-        import random
-        button_text = str(random.randint(100000, 999999))
-        html_content = f"""
-<a href="https://{self.custom_domain}" target="_blank" style="display: inline-block; text-decoration: none; background-color: blue; color: white; padding: 10px 20px; border-radius: 4px; font-weight: bold;">{button_text}</a>
-        <p style="font-size: 14px; color: #6c757d;">
-            • URL: https://{self.custom_domain}<br>
-        </p> <p>Timestamp: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")}</p>
-        """
+        html_content = self._html_template.format(button_text=_BUTTON_PLACEHOLDER, timestamp=batch_timestamp)
 
         # Plain text version for clients that don't support HTML
-        text_content = f"""
-Email Delivery Test - Telegram Bot
-
-This is a test email sent via Telegram Email Tester Bot.
-
-Test Link: https://{self.custom_domain}
-Button Text: {button_text}
-
-If you received this email, your SMTP configuration is working correctly!
-
----
-This email was sent by Telegram Email Tester Bot
-        """
+        text_content = self._text_template.format(button_text=_BUTTON_PLACEHOLDER)
 
-        # Create message parts
-        text_part = MIMEText(text_content, 'plain')
-        html_part = MIMEText(html_content, 'html')
+        # ASCII bodies go out 7bit, anything else as 8bit UTF-8. Neither
+        # transfer-encodes the text, so the placeholders stay byte-for-byte intact
+        cte = '7bit' if text_content.isascii() and html_content.isascii() else '8bit'
+        message.set_content(text_content, cte=cte)
+        message.add_alternative(html_content, subtype='html', cte=cte)
 
-        # Attach parts
-        message.attach(text_part)
-        message.attach(html_part)
+        return message.as_bytes()
 
-        return message
\ No newline at end of file
+    def _render_message(self, template: bytes, recipient_email: str) -> bytes:
+        """Fill a serialized message template for one recipient"""
+        button_text = str(random.randint(100000, 999999)).encode('ascii')
+        return (template
+                .replace(_RECIPIENT_PLACEHOLDER.encode('ascii'), recipient_email.encode('ascii'))
+                .replace(_BUTTON_PLACEHOLDER.encode('ascii'), button_text))
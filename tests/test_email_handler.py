@@ -0,0 +1,52 @@
+"""Tests for message rendering in email_handler"""
+
+import email
+from email import policy
+
+from email_handler import EmailHandler, _BUTTON_PLACEHOLDER, _RECIPIENT_PLACEHOLDER
+
+SMTP_CONFIG = {
+    'host': 'smtp.example.com',
+    'port': 587,
+    'username': 'sender@example.com',
+    'password': 'secret',
+}
+
+
+def _render(domain):
+    handler = EmailHandler(SMTP_CONFIG, domain)
+    template = handler._create_message_template('2024-01-01 00:00:00 UTC')
+    return template, handler._render_message(template, 'rcpt@example.org')
+
+
+def _bodies(raw):
+    message = email.message_from_bytes(raw, policy=policy.default)
+    return [part.get_content() for part in message.iter_parts()]
+
+
+def test_ascii_domain_renders_7bit():
+    template, raw = _render('example.com')
+    assert b'Content-Transfer-Encoding: 7bit' in template
+    assert b'https://example.com' in raw
+    assert _RECIPIENT_PLACEHOLDER.encode() not in raw
+    assert _BUTTON_PLACEHOLDER.encode() not in raw
+
+
+def test_idn_domain_is_punycoded():
+    template, raw = _render('münchen.de')
+    assert template.isascii()
+    assert b'https://xn--mnchen-3ya.de' in raw
+    assert b'To: rcpt@example.org' in raw
+    assert _BUTTON_PLACEHOLDER.encode() not in raw
+
+
+def test_non_idn_domain_falls_back_to_utf8():
+    # Too long for a DNS label, so IDNA encoding fails
+    domain = 'ü' * 70 + '.de'
+    template, raw = _render(domain)
+    assert b'Content-Transfer-Encoding: 8bit' in template
+    assert b'To: rcpt@example.org' in raw
+    assert _BUTTON_PLACEHOLDER.encode() not in raw
+    text, html = _bodies(raw)
+    assert f'https://{domain}' in text
+    assert f'https://{domain}' in html
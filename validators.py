@@ -6,10 +6,17 @@ Contains validation functions for emails and SMTP configurations
 import re
 from typing import Dict, List, Any
 
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
 def validate_email(email: str) -> bool:
     """Validate email address format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    # Cheap RFC 5321 length limits first, the regex only runs on plausible input
+    if len(email) > 254:
+        return False
+    at = email.find('@')
+    if at <= 0 or at > 64:
+        return False
+    return EMAIL_PATTERN.match(email) is not None
 
 def validate_email_list(emails: List[str]) -> Dict[str, Any]:
     """Validate a list of email addresses"""
@@ -23,29 +30,37 @@ def validate_email_list(emails: List[str]) -> Dict[str, Any]:
             'invalid_count': 0
         }
 
-    if len(emails) > 100:
-        return {
-            'valid': False,
-            'error': 'Too many email addresses. Maximum 100 allowed per test',
-            'valid_emails': [],
-            'invalid_emails': [],
-            'valid_count': 0,
-            'invalid_count': 0
-        }
-
     valid_emails = []
     invalid_emails = []
+    seen = set()
 
+    # Strip, deduplicate and validate in a single pass
     for email in emails:
         email = email.strip()
         if not email:
             continue
 
+        key = email.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+
         if validate_email(email):
             valid_emails.append(email)
         else:
             invalid_emails.append(email)
 
+    # Capped after deduplication so repeated addresses don't count twice
+    if len(valid_emails) + len(invalid_emails) > 100:
+        return {
+            'valid': False,
+            'error': 'Too many email addresses. Maximum 100 allowed per test',
+            'valid_emails': [],
+            'invalid_emails': [],
+            'valid_count': 0,
+            'invalid_count': 0
+        }
+
     return {
         'valid': len(valid_emails) > 0,
         'error': None if len(valid_emails) > 0 else 'No valid email addresses found',